@@ -7,7 +7,7 @@ App standalone (1 fichier) qui remplace ton Google Apps Script
 - Pas d'installation sur le PC cible : on fabriquera un exécutable Linux avec GitHub Actions (PyInstaller)
 
 👉 Comment l'utiliser en dev (sur une machine où tu peux tester) :
-    pip install fastapi uvicorn sqlmodel jinja2 pydantic typing_extensions python-multipart
+    pip install fastapi uvicorn sqlmodel jinja2 pydantic typing_extensions python-multipart orjson
     python app.py
     # puis ouvrir http://127.0.0.1:8000/
 
@@ -20,16 +20,33 @@ Notes
 - Prix : alignés à ton GAS (Élève 8, Prof 12, Sandwich 6, Boisson 2, Chocolat 1.5). Fond de caisse 150 CHF.
 """
 from __future__ import annotations
+import asyncio
+import gzip
+import hashlib
 import os
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
-from datetime import date, datetime, time
-from typing import Optional, Dict, List
-
-from fastapi import FastAPI, Request, HTTPException, UploadFile, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from time import monotonic, time as epoch
+from typing import Optional, Dict, List, Tuple
+
+import orjson
+from jinja2 import DictLoader, Environment
+from fastapi import BackgroundTasks, FastAPI, Request, Response, HTTPException, UploadFile, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, ORJSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
+from sqlalchemy import Index, String, delete, event, exists, func, insert, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlmodel import SQLModel, Field, create_engine, Session, select
 
 APP_TITLE = "CAFÉTÉRIA CO FLORENCE"
@@ -38,9 +55,13 @@ PRICES = {"ELEVE": 8.0, "PROF": 12.0, "SANDWICH": 6.0, "BOISSON": 2.0, "CHOCOLAT
 CASH_FLOAT = 150.0
 
 # ---------- Modèles SQL ----------
+def epoch_s() -> int:
+    return int(epoch())
+
 class ParamRow(SQLModel, table=True):
+    __table_args__ = (Index("ix_param_date_open", "date_iso", "open"),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    date_iso: str
+    date_iso: str = Field(index=True)
     jour: str
     menu: str = ""
     open: bool = False
@@ -48,40 +69,151 @@ class ParamRow(SQLModel, table=True):
 
 class Reservation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    date_iso: str
+    date_iso: str = Field(index=True)
     name: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: int = Field(default_factory=epoch_s)  # secondes UTC (epoch)
+
+# nature d'une ligne de caisse, fixée à l'insertion : les totaux comparent des entiers, pas des libellés
+KIND_ELEVE, KIND_PROF, KIND_SANDWICH, KIND_BOISSON, KIND_CHOCOLAT, KIND_CLOSED = range(6)
 
 class TillRow(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_tillrow_date_type", "date_iso", "type"),
+        Index("ix_tillrow_date_kind", "date_iso", "kind"),
+        # au plus une fermeture par jour, garanti par la base (deux clôtures concurrentes ne passent pas)
+        Index("ux_tillrow_closed", "date_iso", unique=True, sqlite_where=text("type = 'Closed'")),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    date_iso: str
+    date_iso: str = Field(index=True)
     name: str = ""
     type: str  # Eleve (CASH) / Eleve (CARD) / Prof (...) / Sandwich / Boisson / Chocolat / Closed
+    kind: int  # KIND_* ci-dessus
     base: float = 0.0
     beverage: float = 0.0
     chocolate: float = 0.0
     total: float = 0.0  # cash reçu pour la ligne
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: int = Field(default_factory=epoch_s)  # secondes UTC (epoch)
+
+class DailyTotals(SQLModel, table=True):
+    # totaux du jour tenus à jour (UPSERT) dans la même transaction que chaque ligne de caisse
+    date_iso: str = Field(primary_key=True)
+    menus: int = 0
+    eleves: int = 0
+    profs: int = 0
+    sandwiches: int = 0
+    beverages: int = 0
+    chocolates: int = 0
+    amount: float = 0.0
+
+class _SharedConnPool(StaticPool):
+    """Une seule connexion partagée : le cache de pages SQLite reste chaud d'une requête à l'autre.
+    Comme tout passe par cette connexion, on n'en prête qu'une Session à la fois (sinon deux requêtes
+    concurrentes partageraient la même transaction)."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._lock = threading.Lock()
+
+    def _do_get(self):
+        self._lock.acquire()
+        try:
+            return super()._do_get()
+        except BaseException:
+            self._lock.release()  # connexion impossible : ne pas bloquer les écritures suivantes
+            raise
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._lock.release()
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL + synchronous=NORMAL : un seul fsync par commit au lieu du double fsync du journal
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-65536")  # 64 Mo
+    cur.execute("PRAGMA mmap_size=268435456")  # 256 Mo
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
+def sqlite_engine(**pool):
+    eng = create_engine(f"sqlite:///{DB_PATH}", echo=False, connect_args={"check_same_thread": False}, **pool)
+    event.listen(eng, "connect", _sqlite_pragmas)
+    return eng
+
+# Écritures et lectures sur deux connexions : en WAL un lecteur ne bloque jamais derrière une écriture
+# (le module sqlite3 relâche le GIL pendant les appels SQLite), donc /api/initial et /api/caisse
+# ne font pas la queue derrière un encaissement en cours.
+# SQLite n'accepte qu'un écrivain : une connexion unique pour les écritures (pas de SQLITE_BUSY entre
+# nos propres threads), un vrai pool pour les lectures, qui peuvent tourner en parallèle en WAL.
+engine = sqlite_engine(poolclass=_SharedConnPool)
+read_engine = sqlite_engine(poolclass=QueuePool, pool_size=20, max_overflow=10, pool_pre_ping=True, pool_recycle=3600)
 
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, connect_args={"check_same_thread": False})
 SQLModel.metadata.create_all(engine)
+# create_all ne touche pas aux tables existantes : colonne kind ajoutée et déduite du libellé sur une base déjà en place
+with engine.begin() as _c:
+    if "kind" not in {r[1] for r in _c.execute(text("PRAGMA table_info(tillrow)"))}:
+        _c.execute(text("ALTER TABLE tillrow ADD COLUMN kind INTEGER NOT NULL DEFAULT 0"))
+        _c.execute(text(f"""
+            UPDATE tillrow SET kind = CASE type
+                WHEN 'Sandwich' THEN {KIND_SANDWICH} WHEN 'Boisson' THEN {KIND_BOISSON}
+                WHEN 'Chocolat' THEN {KIND_CHOCOLAT} WHEN 'Closed' THEN {KIND_CLOSED}
+                ELSE CASE WHEN type LIKE '%eleve%' THEN {KIND_ELEVE} ELSE {KIND_PROF} END END"""))
+# Puis les index manquants (doublons de fermeture d'avant l'index unique retirés d'abord, sinon sa création échoue)
+with engine.begin() as _c:
+    _c.execute(text("DELETE FROM tillrow WHERE type = 'Closed' AND id NOT IN "
+                    "(SELECT min(id) FROM tillrow WHERE type = 'Closed' GROUP BY date_iso)"))
+for _table in SQLModel.metadata.sorted_tables:
+    for _ix in _table.indexes:
+        _ix.create(engine, checkfirst=True)
+# jours encaissés avant l'existence de DailyTotals : recalculés une fois depuis TillRow
+with engine.begin() as _c:
+    _c.execute(text(f"""
+        INSERT INTO dailytotals (date_iso, menus, eleves, profs, sandwiches, beverages, chocolates, amount)
+        SELECT date_iso,
+               sum(kind <= {KIND_PROF}),
+               sum(kind = {KIND_ELEVE}),
+               sum(kind = {KIND_PROF}),
+               sum(kind = {KIND_SANDWICH}),
+               sum(kind = {KIND_BOISSON}) + sum(kind <= {KIND_PROF} AND beverage > 0),
+               sum(kind = {KIND_CHOCOLAT}) + sum(kind <= {KIND_PROF} AND chocolate > 0),
+               coalesce(sum(total), 0.0)
+        FROM tillrow
+        WHERE kind != {KIND_CLOSED} AND date_iso NOT IN (SELECT date_iso FROM dailytotals)
+        GROUP BY date_iso"""))
 
 # ---------- Utils ----------
-DAYS = ["Dimanche","Lundi","Mardi","Mercredi","Jeudi","Vendredi","Samedi"]
+DAY_BY_WEEKDAY = ("Lundi","Mardi","Mercredi","Jeudi","Vendredi","Samedi","Dimanche")  # index = date.weekday()
+
+_today_cache = ("", 0.0)  # (iso, valable jusqu'à monotonic())
 
 def today_iso() -> str:
+    # recalculé au plus toutes les 60 s, et jamais au-delà de minuit
+    global _today_cache
+    iso, until = _today_cache
+    now = monotonic()
+    if now < until:
+        return iso
     tz_now = datetime.now()  # PC local
-    return date(tz_now.year, tz_now.month, tz_now.day).isoformat()
+    today = tz_now.date()
+    iso = today.isoformat()
+    to_midnight = (datetime.combine(today + timedelta(days=1), time.min) - tz_now).total_seconds()
+    _today_cache = (iso, now + min(60.0, to_midnight))
+    return iso
 
+@lru_cache(maxsize=1024)
 def pretty_fr_header(iso: str) -> str:
     y, m, d = map(int, iso.split("-"))
-    dt = date(y, m, d)
-    return f"{DAYS[dt.weekday()+1 if dt.weekday()<6 else 0]} {d:02d}.{m:02d}"
+    return f"{DAY_BY_WEEKDAY[date(y, m, d).weekday()]} {d:02d}.{m:02d}"
 
 def to_iso_any(s: str) -> str:
     s = (s or "").strip()
-    if not s:
-        return today_iso()
+    # le repli "aujourd'hui" n'est pas mis en cache, seul le parsing l'est
+    return (parse_iso_any(s) if s else None) or today_iso()
+
+@lru_cache(maxsize=1024)
+def parse_iso_any(s: str) -> Optional[str]:
     # dd.MM.yyyy
     if len(s) == 10 and s[2] == "." and s[5] == ".":
         dd, mm, yyyy = s.split(".")
@@ -94,18 +226,38 @@ def to_iso_any(s: str) -> str:
         dt = datetime.fromisoformat(s)
         return dt.date().isoformat()
     except Exception:
-        return today_iso()
+        return None
 
+@lru_cache(maxsize=4096)  # mêmes noms à chaque /api/caisse : la normalisation n'est faite qu'une fois
 def norm_name(s: str) -> str:
     return " ".join((s or "").strip().upper().split())
 
 # ---------- App & templates ----------
-app = FastAPI(title=APP_TITLE)
-TEMPLATES_DIR = Path(__file__).with_name("templates")
-TEMPLATES_DIR.mkdir(exist_ok=True)
+OPTIMIZE_EVERY_S = 15 * 60
+
+def sqlite_optimize():
+    # met à jour les statistiques du planificateur (sqlite_stat*) si nécessaire ; peu coûteux
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+
+async def periodic_optimize():
+    while True:
+        await asyncio.sleep(OPTIMIZE_EVERY_S)
+        try:
+            await run_in_threadpool(sqlite_optimize)
+        except Exception:
+            pass
 
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    task = asyncio.create_task(periodic_optimize())
+    yield
+    task.cancel()
+    await run_in_threadpool(sqlite_optimize)  # recommandé par SQLite avant fermeture
 
+app = FastAPI(title=APP_TITLE, default_response_class=ORJSONResponse, lifespan=lifespan)  # orjson : sérialisation JSON en C
+# gzip pour le JSON ; les pages/CSS sont déjà compressées une fois pour toutes (le middleware les laisse passer)
+app.add_middleware(GZipMiddleware, minimum_size=500)
 # --- Templates (importe tes HTML quasi à l'identique, version fetch() au lieu de google.script.run) ---
 PAGE_HTML = r"""<!DOCTYPE html>
 <html>
@@ -113,9 +265,7 @@ PAGE_HTML = r"""<!DOCTYPE html>
   <meta charset="utf-8"><title>CAFÉTÉRIA CO FLORENCE</title>
   <meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
   <meta http-equiv="Pragma" content="no-cache"><meta http-equiv="Expires" content="0">
-  <style>
-  {{ css_common|safe }}
-  </style>
+  <link rel="stylesheet" href="/static/app.css?v={{ css_version }}">
 </head>
 <body>
   <h1>CAFÉTÉRIA CO FLORENCE</h1>
@@ -216,9 +366,7 @@ PAGE_HTML = r"""<!DOCTYPE html>
 """
 
 CAISSE_HTML = r"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Caisse — {{ title }}</title>
-  <style>
-  {{ css_common|safe }}
-  </style></head>
+  <link rel="stylesheet" href="/static/app.css?v={{ css_version }}"></head>
 <body>
   <header>
     <h1 id="title">Caisse</h1>
@@ -285,14 +433,14 @@ CAISSE_HTML = r"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Caisse
   document.getElementById('cancel').onclick = closeModal;
   document.getElementById('ok').onclick = async function(){
     const t=document.querySelector('input[name="rtype"]:checked').value; const pay=document.querySelector('input[name="rpay"]:checked').value; const bev=document.getElementById('bev').checked; const choc=document.getElementById('choc').checked; const name=isWalkIn ? (document.getElementById('nameInput').value.trim()||'Anonyme') : currentName;
-    try{ const r=await fetch('/api/checkout', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({name, type:t, beverage: bev, chocolate: choc, dateIso, method: pay})}); if(!r.ok){ const t=await r.text(); alert(t); await refresh(); return;} const data=await r.json(); closeModal(); showToast('Validé ✔'); updateFromData(data);}catch(e){ alert('Erreur: '+e); }
+    try{ const r=await fetch('/api/checkout', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({name, type:t, beverage: bev, chocolate: choc, dateIso, method: pay})}); if(!r.ok){ const t=await r.text(); alert(t); await refresh(); return;} closeModal(); showToast('Validé ✔'); await refresh();}catch(e){ alert('Erreur: '+e); }
   };
 
   function openQtyModal(kind){ currentAddType=kind; qty=1; document.getElementById('qtyDisplay').textContent=qty; document.getElementById('qtyTitle').textContent = kind==='sand' ? 'Ajouter des Sandwiches' : kind==='bev' ? 'Ajouter des Boissons' : 'Ajouter des Chocolats'; document.getElementById('qtyOverlay').style.display='flex'; }
   function closeQtyModal(){ document.getElementById('qtyOverlay').style.display='none'; }
   document.getElementById('plus1').onclick=()=>{ qty=Math.min(999, qty+1); document.getElementById('qtyDisplay').textContent=qty; };
   document.getElementById('qtyCancel').onclick=closeQtyModal;
-  document.getElementById('qtyOk').onclick=async function(){ const f=currentAddType==='sand'?'sandwich': currentAddType==='bev'?'beverage':'chocolate'; try{ const r=await fetch('/api/add/'+f, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({qty, dateIso})}); const data=await r.json(); closeQtyModal(); showToast('+ '+(currentAddType==='sand'?'Sandwich': currentAddType==='bev'?'Boisson':'Chocolat')); updateFromData(data);}catch(e){ alert('Erreur: '+e); }
+  document.getElementById('qtyOk').onclick=async function(){ const f=currentAddType==='sand'?'sandwich': currentAddType==='bev'?'beverage':'chocolate'; try{ const r=await fetch('/api/add/'+f, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({qty, dateIso})}); closeQtyModal(); showToast('+ '+(currentAddType==='sand'?'Sandwich': currentAddType==='bev'?'Boisson':'Chocolat')); await refresh();}catch(e){ alert('Erreur: '+e); }
   };
 
   function openConfirm(){ document.getElementById('confirmOverlay').style.display='flex'; }
@@ -369,25 +517,60 @@ CSS_COMMON = r"""
   #toast{position:fixed;bottom:16px;left:50%;transform:translateX(-50%);background:rgba(0,0,0,.85);color:#fff;padding:10px 14px;border-radius:10px;font-size:.95rem;z-index:1100;display:none}
 """
 
-# Écrit les templates sur disque (utile pour PyInstaller --add-data)
-(TEMPLATES_DIR / "page.html").write_text(PAGE_HTML, encoding="utf-8")
-(TEMPLATES_DIR / "caisse.html").write_text(CAISSE_HTML, encoding="utf-8")
-(TEMPLATES_DIR / "closed.html").write_text(CLOSED_HTML, encoding="utf-8")
+# Templates chargés depuis la mémoire : rien à écrire sur disque (ni à embarquer avec PyInstaller)
+templates = Environment(
+    loader=DictLoader({"page.html": PAGE_HTML, "caisse.html": CAISSE_HTML, "closed.html": CLOSED_HTML}),
+    autoescape=True,
+)
+
+def with_etag(body: bytes):
+    # (corps, corps gzip précompressé, etag) ; la variante gzip a son propre etag
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    return body, gzip.compress(body, 9), digest
+
+# CSS servi à part (/static/app.css) : mis en cache par le navigateur, l'URL change avec le contenu
+CSS_RENDERED = with_etag(CSS_COMMON.encode("utf-8"))
+CSS_VERSION = CSS_RENDERED[2]
+
+# Rendu unique à l'import : le seul contexte (titre, version CSS) est constant
+def prerender(name: str, **ctx):
+    return with_etag(templates.get_template(name).render(**ctx).encode("utf-8"))
+
+PAGE_RENDERED = prerender("page.html", css_version=CSS_VERSION)
+CAISSE_RENDERED = prerender("caisse.html", title=APP_TITLE, css_version=CSS_VERSION)
+CLOSED_RENDERED = prerender("closed.html")
+
+def cached_body(req: Request, rendered, media_type: str = "text/html", cache_control: str = "public, max-age=60") -> Response:
+    body, gz, digest = rendered
+    use_gzip = "gzip" in req.headers.get("accept-encoding", "")
+    etag = f'"{digest}-gz"' if use_gzip else f'"{digest}"'
+    headers = {"Cache-Control": cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+    if req.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = gz
+    return Response(body, media_type=media_type, headers=headers)
 
 # ---------- Routes pages ----------
+@app.get("/static/app.css")
+async def app_css(req: Request):
+    return cached_body(req, CSS_RENDERED, media_type="text/css", cache_control="public, max-age=31536000, immutable")
+
 @app.get("/", response_class=HTMLResponse)
-def home(req: Request):
-    return templates.TemplateResponse("page.html", {"request": req, "css_common": CSS_COMMON})
+async def home(req: Request):
+    return cached_body(req, PAGE_RENDERED)
 
 @app.get("/caisse", response_class=HTMLResponse)
-def caisse(req: Request, date: Optional[str] = None):
-    return templates.TemplateResponse("caisse.html", {"request": req, "title": APP_TITLE, "css_common": CSS_COMMON})
+async def caisse(req: Request, date: Optional[str] = None):
+    return cached_body(req, CAISSE_RENDERED)
 
 @app.get("/closed", response_class=HTMLResponse)
-def closed(req: Request):
-    return templates.TemplateResponse("closed.html", {"request": req})
+async def closed(req: Request):
+    return cached_body(req, CLOSED_RENDERED)
 
 # ---------- API (équivalents GAS) ----------
+# Handlers async : seul le travail SQLite (bloquant) part dans le threadpool, en un seul saut par requête.
 class ReserveIn(BaseModel):
     name: str
     dateStr: str
@@ -404,12 +587,8 @@ class CheckoutIn(BaseModel):
     dateIso: Optional[str] = None
     method: str = "CASH"  # CASH | CARD
 
-class QtyIn(BaseModel):
-    qty: int
-    dateIso: Optional[str] = None
-
 @app.get("/api/initial")
-def api_initial():
+async def api_initial():
     """Retourne {days:[{date:'dd.MM.yyyy', jour, menu, open, disabled}], reservations: { 'dd.MM.yyyy': [names...] }}"""
     tz_today = date.today()
     wanted = [
@@ -418,32 +597,51 @@ def api_initial():
         {"nom": "Jeudi", "dow": 4},
         {"nom": "Vendredi", "dow": 5},
     ]
-    with Session(engine) as s:
-        rows = s.exec(select(ParamRow)).all()
-        # tri date
-        rows.sort(key=lambda r: r.date_iso)
-        # map pour la réservation
-        all_res = s.exec(select(Reservation)).all()
-    # Résas par dd.MM.yyyy
+    rows = await run_in_threadpool(load_initial_rows, [w["nom"] for w in wanted], tz_today.isoformat())
+    # une ligne par (jour affiché, inscrit), triées par date puis ordre d'inscription
+    firsts: Dict[str, dict] = {}
     reservations_map: Dict[str, List[str]] = {}
-    for r in all_res:
-        y, m, d = map(int, r.date_iso.split("-"))
-        key = f"{d:02d}.{m:02d}.{y:04d}"
-        reservations_map.setdefault(key, []).append(r.name)
+    for (key, jour, menu, disabled), g in groupby(rows, key=itemgetter(0, 1, 2, 3)):
+        firsts[jour] = {"date": key, "jour": jour, "menu": menu, "open": True, "disabled": disabled}
+        names = [r[4] for r in g if r[4] is not None]
+        if names:
+            reservations_map[key] = names
 
     def first_open_for(day_name: str):
-        candidates = [r for r in rows if r.jour == day_name and r.open and date.fromisoformat(r.date_iso) >= tz_today]
-        candidates.sort(key=lambda r: r.date_iso)
-        if candidates:
-            e = candidates[0]
-            y, m, d = map(int, e.date_iso.split("-"))
-            return {"date": f"{d:02d}.{m:02d}.{y:04d}", "jour": e.jour, "menu": e.menu, "open": True, "disabled": e.disabled}
+        if day_name in firsts:
+            return firsts[day_name]
         # sinon prochain même jour de la semaine à venir (fermé)
         return {"date": next_weekday_str(tz_today, day_name), "jour": day_name, "menu": "", "open": False, "disabled": False}
 
     days_out = [first_open_for(w["nom"]) for w in wanted]
-    return {"days": days_out, "reservations": reservations_map}
-
+    # charge utile bornée (4 jours x 40 noms) : encodée d'un coup par orjson, sans passer par jsonable_encoder
+    return ORJSONResponse({"days": days_out, "reservations": reservations_map})
+
+def ddmmyyyy_sql(col):
+    # yyyy-MM-dd -> dd.MM.yyyy, calculé par SQLite
+    return (func.substr(col, 9, 2, type_=String) + "." + func.substr(col, 6, 2, type_=String)
+            + "." + func.substr(col, 1, 4, type_=String))
+
+def load_initial_rows(day_names: List[str], today_str: str):
+    # première date ouverte à venir par jour de semaine (row_number), jointe à ses inscriptions : une seule requête
+    firsts = (
+        select(
+            ParamRow.date_iso, ParamRow.jour, ParamRow.menu, ParamRow.disabled,
+            func.row_number().over(partition_by=ParamRow.jour, order_by=(ParamRow.date_iso, ParamRow.id)).label("rn"),
+        )
+        .where(ParamRow.open == True, ParamRow.date_iso >= today_str, ParamRow.jour.in_(day_names))
+        .cte("firsts")
+    )
+    stmt = (
+        select(ddmmyyyy_sql(firsts.c.date_iso), firsts.c.jour, firsts.c.menu, firsts.c.disabled, Reservation.name)
+        .select_from(firsts.outerjoin(Reservation, Reservation.date_iso == firsts.c.date_iso))
+        .where(firsts.c.rn == 1)
+        .order_by(firsts.c.date_iso, Reservation.id)
+    )
+    with Session(read_engine) as s:
+        return s.exec(stmt).all()
+
+@lru_cache(maxsize=1024)
 def next_weekday_str(today: date, day_name: str) -> str:
     mapping = {"Lundi": 0, "Mardi": 1, "Mercredi": 2, "Jeudi": 3, "Vendredi": 4, "Samedi": 5, "Dimanche": 6}
     target = mapping.get(day_name, 0)
@@ -453,34 +651,45 @@ def next_weekday_str(today: date, day_name: str) -> str:
     return f"{dt.day:02d}.{dt.month:02d}.{dt.year:04d}"
 
 @app.post("/api/reserve", response_class=PlainTextResponse)
-def api_reserve(inp: ReserveIn):
+async def api_reserve(inp: ReserveIn):
     # inp.dateStr = dd.MM.yyyy
     iso = to_iso_any(inp.dateStr)
-    with Session(engine) as s:
+    await run_in_threadpool(add_reservation, iso, inp.name.strip(), inp.dateStr)
+    invalidate_caisse(iso)
+    return f"Merci {inp.name}, réservation confirmée pour le {inp.dateStr} !"
+
+def add_reservation(iso: str, name: str, date_str: str):
+    with Session(engine) as s, s.begin():
         # journée ouverte ?
-        p = s.exec(select(ParamRow).where(ParamRow.date_iso == iso, ParamRow.open == True)).first()
-        if not p:
-            raise HTTPException(400, detail=f"Le {inp.dateStr} est fermé, impossible de réserver.")
+        n_open = s.exec(select(func.count()).select_from(ParamRow).where(ParamRow.date_iso == iso, ParamRow.open == True)).one()
+        if not n_open:
+            raise HTTPException(400, detail=f"Le {date_str} est fermé, impossible de réserver.")
         # quota 40
-        cnt = s.exec(select(Reservation).where(Reservation.date_iso == iso)).all()
-        if len(cnt) >= 40:
-            raise HTTPException(400, detail=f"Quota de 40 atteint pour le {inp.dateStr}.")
-        s.add(Reservation(date_iso=iso, name=inp.name.strip()))
-        s.commit()
-    return f"Merci {inp.name}, réservation confirmée pour le {inp.dateStr} !"
+        cnt = s.exec(select(func.count()).select_from(Reservation).where(Reservation.date_iso == iso)).one()
+        if cnt >= 40:
+            raise HTTPException(400, detail=f"Quota de 40 atteint pour le {date_str}.")
+        s.add(Reservation(date_iso=iso, name=name))
 
 @app.post("/api/unreserve", response_class=PlainTextResponse)
-def api_unreserve(inp: UnreserveIn):
+async def api_unreserve(inp: UnreserveIn):
     iso = to_iso_any(inp.dateStr)
     target = (inp.name or "").strip()
-    with Session(engine) as s:
-        rows = s.exec(select(Reservation).where(Reservation.date_iso == iso)).all()
-        for r in rows:
-            if (r.name or "").strip() == target:
-                s.delete(r); s.commit();
-                return f"Vous êtes désinscrit pour le {inp.dateStr}."
+    if await run_in_threadpool(remove_reservation, iso, target):
+        invalidate_caisse(iso)
+        return f"Vous êtes désinscrit pour le {inp.dateStr}."
     raise HTTPException(400, detail=f"Pas de réservation trouvée pour \"{target}\" le {inp.dateStr}.")
 
+def remove_reservation(iso: str, target: str) -> bool:
+    # un seul DELETE, limité à la première inscription correspondante (homonymes possibles)
+    first_id = (
+        select(func.min(Reservation.id))
+        .where(Reservation.date_iso == iso, func.trim(Reservation.name) == target)
+        .scalar_subquery()
+    )
+    with Session(engine) as s, s.begin():
+        n = s.execute(delete(Reservation).where(Reservation.id == first_id)).rowcount
+    return n > 0
+
 # ---- CAISSE helpers ----
 class Totals(BaseModel):
     menus: int = 0
@@ -497,74 +706,120 @@ class CaisseOut(BaseModel):
     names: List[str]
     totals: Totals
 
-def is_closed(iso: str) -> bool:
-    with Session(engine) as s:
-        x = s.exec(select(TillRow).where(TillRow.date_iso == iso, TillRow.type == "Closed")).first()
-        return bool(x)
+# Cache par date de (fermée, totaux, payés par nom), invalidé après chaque écriture dans TillRow.
+# La génération évite de remettre en cache un calcul lancé avant une écriture concurrente.
+_caisse_cache: Dict[str, Tuple[bool, Totals, Dict[str, int]]] = {}
+_caisse_gen: Dict[str, int] = {}
+_caisse_lock = threading.Lock()
+# (époque, génération du jour) sert aussi d'ETag à /api/caisse ; l'époque change à chaque démarrage et import CSV
+_caisse_epoch = int(epoch() * 1000)
+
+def invalidate_caisse(iso: str):
+    with _caisse_lock:
+        _caisse_cache.pop(iso, None)
+        _caisse_gen[iso] = _caisse_gen.get(iso, 0) + 1
+
+def invalidate_all_caisses():
+    global _caisse_epoch
+    with _caisse_lock:
+        _caisse_epoch += 1
+
+def caisse_etag(iso: str) -> str:
+    with _caisse_lock:
+        return f'W/"{_caisse_epoch}-{iso}-{_caisse_gen.get(iso, 0)}"'
+
+def caisse_state(iso: str, s: Optional[Session] = None) -> Tuple[bool, Totals, Dict[str, int]]:
+    with _caisse_lock:
+        hit = _caisse_cache.get(iso)
+        gen = _caisse_gen.get(iso, 0)
+    if hit is not None:
+        return hit
+    if s is None:
+        with Session(read_engine) as s:
+            state = till_state(s, iso)
+    else:
+        state = till_state(s, iso)
+    with _caisse_lock:
+        if _caisse_gen.get(iso, 0) == gen:
+            _caisse_cache[iso] = state
+    return state
+
+def closed_in(s: Session, iso: str) -> bool:
+    return bool(s.exec(select(exists().where(TillRow.date_iso == iso, TillRow.type == "Closed"))).one())
+
+def build_totals(iso: str, s: Optional[Session] = None):
+    _, t, paidCount = caisse_state(iso, s)
+    return t, paidCount
 
-def build_totals(iso: str):
-    t = Totals()
+def till_state(s: Session, iso: str) -> Tuple[bool, Totals, Dict[str, int]]:
+    # totaux : une lecture par clé primaire dans DailyTotals ; fermeture : sonde EXISTS sur l'index
+    closed = closed_in(s, iso)
+    dt = s.get(DailyTotals, iso)
+    t = Totals(**dt.model_dump(exclude={"date_iso"})) if dt else Totals()
+    # payés par nom : regroupés sur le nom brut, la normalisation (espaces, casse) reste celle de norm_name
     paidCount: Dict[str, int] = {}
-    with Session(engine) as s:
-        rows = s.exec(select(TillRow).where(TillRow.date_iso == iso)).all()
-    for row in rows:
-        typ = (row.type or "")
-        if typ == "Closed":
-            continue
-        elif typ == "Sandwich":
-            t.sandwiches += 1
-        elif typ == "Boisson":
-            t.beverages += 1
-        elif typ == "Chocolat":
-            t.chocolates += 1
-        else:
-            t.menus += 1
-            if "eleve" in typ.lower(): t.eleves += 1
-            else: t.profs += 1
-            key = norm_name(row.name)
-            if key: paidCount[key] = paidCount.get(key, 0) + 1
-            if row.beverage > 0: t.beverages += 1
-            if row.chocolate > 0: t.chocolates += 1
-        t.amount += float(row.total)
-    return t, paidCount
+    per_name = s.exec(
+        select(TillRow.name, func.count())
+        .where(TillRow.date_iso == iso, TillRow.kind <= KIND_PROF).group_by(TillRow.name)).all()
+    _norm, _get = norm_name, paidCount.get
+    for name, n in per_name:
+        key = _norm(name)
+        if key: paidCount[key] = _get(key, 0) + n
+    return closed, t, paidCount
 
 @app.get("/api/caisse")
-def api_caisse(date: Optional[str] = None):
+async def api_caisse(req: Request, date: Optional[str] = None):
     iso = date if (date and len(date)==10) else today_iso()
-    if is_closed(iso):
-        t,_ = build_totals(iso)
-        return CaisseOut(date=iso, closed=True, names=[], totals=t)
-    # ordre d'inscription
-    with Session(engine) as s:
-        ordered = s.exec(select(Reservation).where(Reservation.date_iso == iso).order_by(Reservation.id)).all()
-    t, paidCount = build_totals(iso)
+    # ETag lu avant le calcul : une écriture concurrente donne au pire un ETag plus ancien que les données
+    etag = caisse_etag(iso)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if req.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    out = await run_in_threadpool(caisse_snapshot, iso)
+    return ORJSONResponse(out.model_dump(), headers=headers)
+
+def caisse_snapshot(iso: str) -> CaisseOut:
+    # une seule session : lignes de caisse (si pas en cache) puis réservations
+    with Session(read_engine) as s:
+        closed, t, paidCount = caisse_state(iso, s)
+        if closed:
+            return CaisseOut(date=iso, closed=True, names=[], totals=t)
+        # ordre d'inscription
+        ordered = s.exec(select(Reservation.name).where(Reservation.date_iso == iso).order_by(Reservation.id)).all()
     remaining: List[str] = []
-    paid_left = dict(paidCount)
-    for r in ordered:
-        k = norm_name(r.name)
-        if paid_left.get(k, 0) > 0:
-            paid_left[k] -= 1
+    # un payé « consomme » la première réservation à son nom ; un seul passage garde l'ordre d'inscription
+    paid = Counter(paidCount)
+    _norm, _left, _set, _append = norm_name, paid.__getitem__, paid.__setitem__, remaining.append
+    for name in ordered:
+        k = _norm(name)
+        left = _left(k)
+        if left > 0:
+            _set(k, left - 1)
         else:
-            remaining.append(r.name)
+            _append(name)
     return CaisseOut(date=iso, closed=False, names=remaining, totals=t)
 
 # contraintes
 MAX_MENUS = 45
 
-def assert_open(iso: str):
-    if is_closed(iso):
+def assert_open(iso: str, s: Session):
+    # lu dans la transaction d'écriture, jamais dans le cache : entre le commit d'une clôture et son
+    # invalidate_caisse, le cache dit encore « ouvert ». Sonde EXISTS sur l'index (date_iso, type).
+    if closed_in(s, iso):
         raise HTTPException(400, f"Caisse fermée pour {iso}.")
 
-def assert_capacity(iso: str):
-    t,_ = build_totals(iso)
-    if t.menus >= MAX_MENUS:
+def current_menus(iso: str, s: Session) -> int:
+    # une colonne de DailyTotals par clé primaire, lue sur la connexion d'écriture (verrou tenu) : le cache
+    # peut retarder d'un commit tant que l'écrivain précédent n'a pas appelé invalidate_caisse
+    return s.exec(select(DailyTotals.menus).where(DailyTotals.date_iso == iso)).first() or 0
+
+def assert_capacity(iso: str, s: Session):
+    if current_menus(iso, s) >= MAX_MENUS:
         raise HTTPException(400, f"Limite de 45 menus servis atteinte pour {pretty_fr_header(iso)}.")
 
 @app.post("/api/checkout")
-def api_checkout(inp: CheckoutIn):
+async def api_checkout(inp: CheckoutIn):
     iso = inp.dateIso or today_iso()
-    assert_open(iso)
-    assert_capacity(iso)
     typ = (inp.type or "PROF").upper()
     method = (inp.method or "CASH").upper()  # CASH | CARD
     base = PRICES["ELEVE"] if typ == "ELEVE" else PRICES["PROF"]
@@ -572,67 +827,107 @@ def api_checkout(inp: CheckoutIn):
     choc = PRICES["CHOCOLAT"] if inp.chocolate else 0.0
     total_cash = (bev + choc) if method == "CARD" else (base + bev + choc)
     type_label = ("Eleve" if typ == "ELEVE" else "Prof") + (" (CARD)" if method == "CARD" else " (CASH)")
-    with Session(engine) as s:
-        s.add(TillRow(date_iso=iso, name=inp.name.strip() or "Anonyme", type=type_label, base=base, beverage=bev, chocolate=choc, total=total_cash))
-        s.commit()
-    return api_caisse(iso)
+    row = TillRow(date_iso=iso, name=inp.name.strip() or "Anonyme", type=type_label, kind=KIND_ELEVE if typ == "ELEVE" else KIND_PROF, base=base, beverage=bev, chocolate=choc, total=total_cash)
+    await run_in_threadpool(record_checkout, iso, row)
+    return {"ok": True}
+
+def record_checkout(iso: str, row: TillRow):
+    eleve = row.kind == KIND_ELEVE
+    # une seule session : contrôles et insertion dans la même transaction d'écriture
+    with Session(engine) as s, s.begin():
+        assert_open(iso, s)
+        assert_capacity(iso, s)
+        s.add(row)
+        bump_totals(s, iso, menus=1, eleves=int(eleve), profs=int(not eleve), beverages=int(row.beverage > 0),
+                    chocolates=int(row.chocolate > 0), amount=row.total)
+    invalidate_caisse(iso)
+
+def add_till_rows(s: Session, iso: str, typ: str, n: int, **amounts: float):
+    # un seul INSERT (executemany) pour les n lignes, sans objets ORM
+    row = {"date_iso": iso, "name": "", "type": typ, "kind": ITEM_KINDS[typ], "base": 0.0, "beverage": 0.0, "chocolate": 0.0, "total": 0.0,
+           "created_at": epoch_s(), **amounts}
+    s.execute(insert(TillRow), [row] * n)
+    bump_totals(s, iso, **{ITEM_TOTALS[typ]: n}, amount=row["total"] * n)
+
+ITEM_TOTALS = {"Sandwich": "sandwiches", "Boisson": "beverages", "Chocolat": "chocolates"}
+ITEM_KINDS = {"Sandwich": KIND_SANDWICH, "Boisson": KIND_BOISSON, "Chocolat": KIND_CHOCOLAT}
+
+def bump_totals(s: Session, iso: str, **deltas):
+    # INSERT ... ON CONFLICT(date_iso) DO UPDATE SET col = col + excluded.col
+    stmt = sqlite_insert(DailyTotals).values(date_iso=iso, **deltas)
+    s.execute(stmt.on_conflict_do_update(
+        index_elements=["date_iso"],
+        set_={k: getattr(DailyTotals, k) + stmt.excluded[k] for k in deltas}))
+
+async def read_qty(req: Request) -> Tuple[str, int]:
+    # corps {qty, dateIso} : deux champs triviaux, lus directement sans modèle Pydantic
+    try:
+        data = orjson.loads(await req.body())
+        iso = data.get("dateIso") or today_iso()
+        n = max(1, int(data.get("qty") or 1))
+        if not isinstance(iso, str):
+            raise TypeError(iso)
+    except (orjson.JSONDecodeError, AttributeError, TypeError, ValueError):
+        raise HTTPException(422, "Corps JSON invalide : {qty, dateIso} attendu.")
+    return iso, n
+
+def add_items(iso: str, typ: str, n: int, **amounts: float):
+    with Session(engine) as s, s.begin():
+        assert_open(iso, s)
+        add_till_rows(s, iso, typ, n, **amounts)
+    invalidate_caisse(iso)
 
 @app.post("/api/add/sandwich")
-def api_add_sandwich(inp: QtyIn):
-    iso = inp.dateIso or today_iso()
-    assert_open(iso)
-    n = max(1, int(inp.qty or 1))
-    with Session(engine) as s:
-        for _ in range(n):
-            s.add(TillRow(date_iso=iso, type="Sandwich", base=PRICES["SANDWICH"], total=PRICES["SANDWICH"]))
-        s.commit()
-    return api_caisse(iso)
+async def api_add_sandwich(req: Request):
+    iso, n = await read_qty(req)
+    await run_in_threadpool(add_items, iso, "Sandwich", n, base=PRICES["SANDWICH"], total=PRICES["SANDWICH"])
+    return {"ok": True}
 
 @app.post("/api/add/beverage")
-def api_add_beverage(inp: QtyIn):
-    iso = inp.dateIso or today_iso()
-    assert_open(iso)
-    n = max(1, int(inp.qty or 1))
-    with Session(engine) as s:
-        for _ in range(n):
-            s.add(TillRow(date_iso=iso, type="Boisson", beverage=PRICES["BOISSON"], total=PRICES["BOISSON"]))
-        s.commit()
-    return api_caisse(iso)
+async def api_add_beverage(req: Request):
+    iso, n = await read_qty(req)
+    await run_in_threadpool(add_items, iso, "Boisson", n, beverage=PRICES["BOISSON"], total=PRICES["BOISSON"])
+    return {"ok": True}
 
 @app.post("/api/add/chocolate")
-def api_add_chocolate(inp: QtyIn):
-    iso = inp.dateIso or today_iso()
-    assert_open(iso)
-    n = max(1, int(inp.qty or 1))
-    with Session(engine) as s:
-        for _ in range(n):
-            s.add(TillRow(date_iso=iso, type="Chocolat", chocolate=PRICES["CHOCOLAT"], total=PRICES["CHOCOLAT"]))
-        s.commit()
-    return api_caisse(iso)
+async def api_add_chocolate(req: Request):
+    iso, n = await read_qty(req)
+    await run_in_threadpool(add_items, iso, "Chocolat", n, chocolate=PRICES["CHOCOLAT"], total=PRICES["CHOCOLAT"])
+    return {"ok": True}
 
 class CloseIn(BaseModel):
     dateIso: Optional[str] = None
 
 @app.post("/api/close")
-def api_close(inp: CloseIn):
+async def api_close(inp: CloseIn, bg: BackgroundTasks):
     iso = inp.dateIso or today_iso()
-    with Session(engine) as s:
-        # envoyer mail si config SMTP présente (facultatif)
-        t,_ = build_totals(iso)
-        try:
-            smtp_to = os.environ.get("SMTP_TO")
-            if smtp_to:
-                send_summary_mail(iso, t)
-        except Exception:
-            pass
-        # marquer fermeture
-        s.add(TillRow(date_iso=iso, type="Closed"))
-        s.commit()
-    return {"ok": True}
+    out, t = await run_in_threadpool(close_day, iso)
+    # mail envoyé après la réponse : un serveur SMTP lent ne bloque plus la clôture
+    if t is not None:
+        bg.add_task(mail_summary, iso, t)
+    return out
+
+def close_day(iso: str):
+    # marquer fermeture : l'index unique ux_tillrow_closed refuse une seconde clôture du même jour
+    try:
+        with Session(engine) as s, s.begin():
+            s.add(TillRow(date_iso=iso, type="Closed", kind=KIND_CLOSED))
+    except IntegrityError:
+        return {"ok": True, "already_closed": True}, None
+    invalidate_caisse(iso)
+    # totaux pour le mail si config SMTP présente (facultatif), une seule fois par jour
+    t = build_totals(iso)[0] if os.environ.get("SMTP_TO") else None
+    return {"ok": True}, t
+
+def mail_summary(iso: str, t: Totals):
+    try:
+        send_summary_mail(iso, t)
+    except Exception:
+        pass
 
 # ---------- Import CSV (Paramètres/Réservations) ----------
 @app.get("/admin", response_class=HTMLResponse)
-def admin(req: Request):
+async def admin(req: Request):
     html = """
     <h2>Import CSV</h2>
     <p>Importe <code>Paramètres</code> (date_iso;jour;menu;open;disabled) et <code>Réservations</code> (date_iso;name)</p>
@@ -645,28 +940,50 @@ def admin(req: Request):
     """
     return HTMLResponse(html)
 
+TRUTHY = ('1','true','vrai','yes')
+
+def csv_rows(upload: UploadFile):
+    import csv, io
+    # lecture en flux : pas de décodage du fichier entier en mémoire
+    return csv.DictReader(io.TextIOWrapper(upload.file, encoding="utf-8", newline=""), delimiter=';')
+
 @app.post("/admin/import")
 def admin_import(params: Optional[UploadFile] = None, resas: Optional[UploadFile] = None):
-    import csv, io
-    with Session(engine) as s:
-        if params and params.filename:
-            text = params.file.read().decode("utf-8")
-            r = csv.DictReader(io.StringIO(text), delimiter=';')
-            s.exec(SQLModel.__table__.delete().where(False))  # no-op to keep import symmetrical
-            for row in r:
-                s.add(ParamRow(date_iso=row['date_iso'], jour=row['jour'], menu=row.get('menu',''), open=row.get('open','').lower() in ('1','true','vrai','yes'), disabled=row.get('disabled','').lower() in ('1','true','vrai','yes')))
-        if resas and resas.filename:
-            text = resas.file.read().decode("utf-8")
-            r = csv.DictReader(io.StringIO(text), delimiter=';')
-            for row in r:
-                s.add(Reservation(date_iso=row['date_iso'], name=row['name']))
-        s.commit()
+    # chemin rapide SQLite : executemany du module sqlite3 sur un générateur (rien n'est matérialisé),
+    # une seule transaction, sans fsync pendant l'import
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA synchronous=OFF")
+        try:
+            if params and params.filename:
+                cur.executemany(
+                    f"INSERT INTO {ParamRow.__tablename__}(date_iso, jour, menu, open, disabled) VALUES (?,?,?,?,?)",
+                    ((row['date_iso'], row['jour'], row.get('menu') or '',
+                      (row.get('open') or '').lower() in TRUTHY,
+                      (row.get('disabled') or '').lower() in TRUTHY)
+                     for row in csv_rows(params)))
+            if resas and resas.filename:
+                now = epoch_s()
+                cur.executemany(
+                    f"INSERT INTO {Reservation.__tablename__}(date_iso, name, created_at) VALUES (?,?,?)",
+                    ((row['date_iso'], row['name'], now) for row in csv_rows(resas)))
+            conn.commit()
+        except BaseException:
+            conn.rollback()  # le PRAGMA ci-dessous est refusé tant qu'une transaction est ouverte
+            raise
+        finally:
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.close()
+    finally:
+        conn.close()
+    invalidate_all_caisses()
     return RedirectResponse("/admin", status_code=303)
 
 # ---------- Mail (facultatif) ----------
 def send_summary_mail(iso: str, t: Totals):
     import smtplib
-    from email.mime.text import MIMEText
+    from email.message import EmailMessage
     to_addr = os.environ.get("SMTP_TO")
     if not to_addr:
         return
@@ -682,14 +999,17 @@ def send_summary_mail(iso: str, t: Totals):
         f"Encaissements cash : {t.amount:.2f} CHF",
         f"Total en caisse attendu : {(CASH_FLOAT + t.amount):.2f} CHF",
     ]
-    msg = MIMEText("\n".join(body))
+    msg = EmailMessage()
+    msg.set_content("\n".join(body))
     msg['Subject'] = f"Comptabilité cafétéria — {pretty_fr_header(iso)}"
     msg['From'] = os.environ.get("SMTP_FROM", "cafeteria@local")
     msg['To'] = to_addr
     host = os.environ.get("SMTP_HOST", "localhost")
-    port = int(os.environ.get("SMTP_PORT", "25"))
-    with smtplib.SMTP(host, port) as s:
-        if os.environ.get("SMTP_STARTTLS"):
+    # SMTP_SSL : TLS implicite dès la connexion (port 465 par défaut), sans l'aller-retour STARTTLS
+    use_ssl = bool(os.environ.get("SMTP_SSL"))
+    port = int(os.environ.get("SMTP_PORT", "465" if use_ssl else "25"))
+    with (smtplib.SMTP_SSL(host, port) if use_ssl else smtplib.SMTP(host, port)) as s:
+        if not use_ssl and os.environ.get("SMTP_STARTTLS"):
             s.starttls()
         user = os.environ.get("SMTP_USER"); pwd = os.environ.get("SMTP_PASS")
         if user and pwd:
@@ -699,6 +1019,5 @@ def send_summary_mail(iso: str, t: Totals):
 # ---------- Dev server ----------
 if __name__ == "__main__":
     import uvicorn
-    # écrit CSS commun dans le contexte
-    templates.env.globals['css_common'] = CSS_COMMON
-    uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=False)
+    # uvloop + httptools (fournis par uvicorn[standard]) ; on passe l'objet app pour ne pas réimporter le module
+    uvicorn.run(app, host="127.0.0.1", port=8000, reload=False, loop="uvloop", http="httptools")
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """
-Appli Cafétéria — backend 100% Google Sheets (pas de base locale)
+Appli Cafétéria — backend Google Sheets (seule la file d'écritures en attente est gardée en local, SQLite)
 - Conserve le classeur Google (partage facile avec collègues)
 - Sert la page d'inscription et la page Caisse (utilisable sur une tablette)
 - Envoie l'e-mail de clôture avec un lien direct vers la page Caisse (LAN)
@@ -9,10 +9,13 @@ Déploiement sans installation sur le PC cible : on produira un exécutable Linu
 Fichiers nécessaires sur le PC:
   - ./Cafeteria  (l'exécutable généré)
   - ./credentials.json (clé Service Account)
+  - ./cafeteria_pending.db (créé au premier lancement : lignes pas encore envoyées au classeur,
+    à déplacer avec l'exécutable pour ne pas les perdre)
 Variables d'environnement requises :
   - SPREADSHEET_ID=... (ID du classeur)
   - HOST=0.0.0.0 (si la tablette doit y accéder via le réseau local, sinon 127.0.0.1)
   - PORT=8000 (optionnel)
+  - PENDING_DB=cafeteria_pending.db (optionnel, chemin de la file d'écritures ; relatif au dossier courant)
   - SMTP_* (optionnels pour l'e-mail)
 
 Sheets attendus dans le classeur (comme ton GAS) :
@@ -24,17 +27,32 @@ Remarque : ton GAS utilisait la couleur de police rouge pour "disabled". Ici on
 colonne booléenne E=disabled pour simplifier.
 """
 from __future__ import annotations
+import asyncio
+import gzip
+import hashlib
+import json
 import os
+import sqlite3
+import orjson
+import threading
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from collections import defaultdict
 from datetime import date, datetime
-from typing import Dict, List, Optional
+from functools import lru_cache
+from time import monotonic, time as epoch
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
-from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 
 import gspread
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 APP_TITLE = "CAFÉTÉRIA CO FLORENCE"
 DAYS = ["Dimanche","Lundi","Mardi","Mercredi","Jeudi","Vendredi","Samedi"]
@@ -42,15 +60,24 @@ PRICES = {"ELEVE": 8.0, "PROF": 12.0, "SANDWICH": 6.0, "BOISSON": 2.0, "CHOCOLAT
 CASH_FLOAT = 150.0
 MAX_RESAS = 40
 MAX_MENUS = 45
+TRUTHY = frozenset(("1","true","vrai","yes","oui","x"))  # cases cochées / booléens saisis à la main
 
 SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID", "")
 HOST = os.environ.get("HOST", "127.0.0.1")
 PORT = int(os.environ.get("PORT", "8000"))
+SHEET_TTL = float(os.environ.get("SHEET_TTL", "10"))  # secondes de cache des lectures de feuilles
 
 # ---------------- Sheets client ----------------
 _scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.readonly"]
 _creds = Credentials.from_service_account_file(os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "credentials.json"), scopes=_scopes)
-_gc = gspread.authorize(_creds)
+# Une seule session HTTP pour tous les appels : connexions TLS gardées ouvertes et réutilisées, et nouvel
+# essai avec attente croissante sur 429/5xx. Retry ne rejoue que les
+# méthodes idempotentes (lectures) : un values.append n'est jamais envoyé deux fois ; après le dernier essai
+# la réponse d'erreur remonte telle quelle (APIError de gspread).
+_session = AuthorizedSession(_creds)
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(
+    total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)))
+_gc = gspread.authorize(_creds, session=_session)
 _ss = _gc.open_by_key(SPREADSHEET_ID) if SPREADSHEET_ID else None
 
 
@@ -67,11 +94,286 @@ def ws(name: str):
         return sh
 
 
+# Cache des lectures : une rafale de GET (tablette, encaissements) ne coûte qu'un appel Sheets par TTL.
+# Les écritures de l'appli mettent le cache à jour sur place ; la génération évite qu'une lecture lancée
+# avant une écriture ne vienne remettre l'ancien contenu en cache.
+# (époque, générations des feuilles) sert aussi d'ETag aux GET ; une relecture qui trouve des modifications
+# faites à la main dans le classeur avance aussi la génération.
+# entrée : (horodatage, lignes, lignes par date en colonne A, lignes telles que renvoyées par la dernière lecture)
+_sheet_cache: Dict[str, Tuple[float, List[List[str]], Dict[str, List[List[str]]], List[List[str]]]] = {}
+_sheet_gen: Dict[str, int] = {}
+_sheet_lock = threading.Lock()
+_sheet_epoch = int(epoch() * 1000)
+
+# Réveil des flux SSE : chaque nouvelle génération remplace l'événement par un neuf et déclenche l'ancien,
+# tous les abonnés en attente repartent une fois. Les écritures tournent dans le pool de threads, d'où call_soon_threadsafe.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_changed = asyncio.Event()
+
+
+def _wake():
+    global _changed
+    ev, _changed = _changed, asyncio.Event()
+    ev.set()
+
+
+def notify_change():
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_wake)
+
+# File d'écriture : les lignes ajoutées sont envoyées par lot toutes les FLUSH_EVERY_S (un appel par feuille),
+# une rafale d'encaissements ne coûte donc qu'un aller-retour. Tant qu'elles ne sont pas écrites, les lectures
+# de la feuille les incluent. Le verrou par feuille sérialise lecture réseau, envoi du lot et suppressions.
+# La file est aussi tenue dans un petit fichier SQLite : un arrêt brutal ou une panne réseau ne perd aucune ligne,
+# elles sont rechargées et envoyées au démarrage suivant.
+FLUSH_EVERY_S = 0.5
+PENDING_DB = os.environ.get("PENDING_DB", "cafeteria_pending.db")
+_pending: Dict[str, List[Tuple[int, list]]] = {}  # feuille -> [(id SQLite, ligne)]
+_sheet_io: Dict[str, threading.RLock] = {}
+
+# mode transactionnel par défaut : « with _pending_db » ouvre une transaction, la valide ou l'annule en bloc
+_pending_db = sqlite3.connect(PENDING_DB, check_same_thread=False)
+_pending_db.execute("PRAGMA journal_mode=WAL")
+_pending_db.execute("PRAGMA synchronous=NORMAL")
+_pending_db.execute("CREATE TABLE IF NOT EXISTS pending_writes (id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row_json TEXT NOT NULL)")
+for _id, _sheet, _row in _pending_db.execute("SELECT id, sheet, row_json FROM pending_writes ORDER BY id"):
+    _pending.setdefault(_sheet, []).append((_id, json.loads(_row)))
+
+
+def sheet_io(name: str) -> threading.RLock:
+    with _sheet_lock:
+        return _sheet_io.setdefault(name, threading.RLock())
+
+
+# Au plus 4 appels Sheets simultanés, quelle que soit la charge : on reste sous le quota par minute
+_sheets_slots = threading.BoundedSemaphore(4)
+
+# Colonnes réellement lues (en-tête compris, pour garder les numéros de ligne) : le timestamp ne sert qu'au classeur
+SHEET_RANGES = {"Paramètres": "A1:E", "Réservations": "A1:B", "Caisse": "A1:G"}
+
+
+def sheet_missing(e: gspread.exceptions.APIError) -> bool:
+    # seul un onglet absent (400 « Unable to parse range ») justifie création et nouvel essai ;
+    # quota épuisé (429) et erreurs serveur remontent sans dépenser d'autres appels
+    return e.code == 400 and "Unable to parse range" in str(e.error.get("message", ""))
+
+
+def fetch_values(names: List[str]) -> Dict[str, List[List[str]]]:
+    # un seul values.batchGet pour toutes les feuilles demandées, limité aux colonnes utiles
+    ranges = [f"'{n}'!{SHEET_RANGES[n]}" for n in names]
+    try:
+        with _sheets_slots:
+            resp = _ss.values_batch_get(ranges)
+    except gspread.exceptions.APIError as e:
+        if not sheet_missing(e):
+            raise
+        for n in names:
+            ws(n)  # crée la feuille manquante
+        with _sheets_slots:
+            resp = _ss.values_batch_get(ranges)
+    out = {}
+    for n, vr in zip(names, resp.get("valueRanges", [])):
+        # l'API omet les cellules vides en fin de ligne : on complète comme get_all_values()
+        width = ord(SHEET_RANGES[n][-1]) - ord("A") + 1
+        out[n] = [r + [""] * (width - len(r)) for r in vr.get("values", [])]
+    return out
+
+
+def index_by_date(rows: List[List[str]]) -> Dict[str, List[List[str]]]:
+    # construit une fois par lecture : les requêtes d'un jour ne parcourent plus tout l'historique
+    idx: Dict[str, List[List[str]]] = defaultdict(list)
+    for r in rows[1:]:  # skip header
+        if r:
+            idx[r[0]].append(r)
+    return dict(idx)
+
+
+def changed_outside(old, raw: List[List[str]], queued: int) -> bool:
+    # Les lignes ajoutées par l'appli reviennent de Sheets dans un autre format ("8" pour 8.0, sans horodatage
+    # hors plage) : on ne compare que la partie déjà lue la fois précédente, et pour le reste le nombre de lignes
+    # (lignes en cache = lignes relues + lignes encore en file si rien n'a bougé ailleurs).
+    prev = old[3]
+    return raw[:len(prev)] != prev or len(raw) + queued != len(old[1])
+
+
+def load_sheets(names: List[str], ttl: float = SHEET_TTL):
+    # (lignes, index par date) de plusieurs feuilles, depuis le cache si assez récent, sinon en un seul appel
+    now = monotonic()
+    out, gens = {}, {}
+    with _sheet_lock:
+        for n in names:
+            hit = _sheet_cache.get(n)
+            if hit and now - hit[0] < ttl:
+                out[n] = hit[1:3]
+            else:
+                gens[n] = _sheet_gen.get(n, 0)
+    stale = sorted(gens)  # ordre fixe des verrous
+    if not stale:
+        return out
+    locks = [sheet_io(n) for n in stale]
+    for lk in locks:
+        lk.acquire()
+    try:
+        fetched = fetch_values(stale)
+        with _sheet_lock:
+            for n in stale:
+                raw = fetched.get(n, [])
+                queued = _pending.get(n, ())
+                vals = raw + [[str(v) for v in r] for _, r in queued]
+                out[n] = (vals, index_by_date(vals))
+                if _sheet_gen.get(n, 0) == gens[n]:
+                    old = _sheet_cache.get(n)
+                    if old is not None and changed_outside(old, raw, len(queued)):
+                        _sheet_gen[n] = gens[n] + 1
+                        notify_change()
+                    _sheet_cache[n] = (now,) + out[n] + (raw,)
+    finally:
+        for lk in reversed(locks):
+            lk.release()
+    return out
+
+
+def get_many(names: List[str], ttl: float = SHEET_TTL) -> Dict[str, List[List[str]]]:
+    return {n: v[0] for n, v in load_sheets(names, ttl).items()}
+
+
+def get_values(name: str, ttl: float = SHEET_TTL) -> List[List[str]]:
+    # toutes les valeurs de la feuille (en-tête compris)
+    return load_sheets([name], ttl)[name][0]
+
+
+def sheets_etag(names: List[str], key: str) -> str:
+    with _sheet_lock:
+        gens = "-".join(str(_sheet_gen.get(n, 0)) for n in names)
+    return f'W/"{_sheet_epoch}-{key}-{gens}"'
+
+
+def fresh_etag(names: List[str], key: str) -> str:
+    # cache rafraîchi d'abord pour que l'ETag suive les données ; lu avant le calcul, une écriture
+    # concurrente donne au pire un ETag plus ancien que les données
+    load_sheets(names)
+    return sheets_etag(names, key)
+
+
+def conditional_json(req: Request, names: List[str], key: str, build):
+    etag = fresh_etag(names, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if req.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(build(), headers=headers)
+
+
+def day_rows(name: str, iso: str, ttl: float = SHEET_TTL) -> List[List[str]]:
+    # lignes de la feuille pour une date, sans parcourir les autres jours
+    return load_sheets([name], ttl)[name][1].get(iso, [])
+
+
+def queue_rows(name: str, rows: List[list]):
+    # même verrou pour SQLite et la file en mémoire : les id restent dans l'ordre de la file
+    with _sheet_lock:
+        with _pending_db:  # une transaction pour tout le lot
+            ids = [_pending_db.execute("INSERT INTO pending_writes (sheet, row_json) VALUES (?, ?)",
+                                       (name, json.dumps(r))).lastrowid for r in rows]
+        _pending.setdefault(name, []).extend(zip(ids, rows))
+    cache_append(name, rows)
+
+
+def flush_sheet(name: str):
+    with sheet_io(name):
+        with _sheet_lock:
+            batch = list(_pending.get(name, ()))
+        if not batch:
+            return
+        append_values(name, [r for _, r in batch])
+        with _sheet_lock:
+            del _pending[name][:len(batch)]
+            with _pending_db:
+                _pending_db.executemany("DELETE FROM pending_writes WHERE id = ?", [(i,) for i, _ in batch])
+
+
+@lru_cache(maxsize=8)
+def sheet_id(name: str) -> int:
+    return ws(name).id  # l'identifiant d'un onglet ne change pas : une seule lecture des métadonnées
+
+
+def delete_row(name: str, row: int):
+    # deleteDimension dans un seul batchUpdate (row : numéro de ligne 1-based)
+    body = {"requests": [{"deleteDimension": {"range": {
+        "sheetId": sheet_id(name), "dimension": "ROWS", "startIndex": row - 1, "endIndex": row}}}]}
+    with _sheets_slots:
+        _ss.batch_update(body)
+
+
+APPEND_PARAMS = {"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"}
+
+
+def append_values(name: str, rows: List[list]):
+    # values.append côté serveur : une seule requête, sans la recherche de feuille ni de dernière ligne
+    rng = f"'{name}'!A:H"
+    try:
+        with _sheets_slots:
+            _ss.values_append(rng, params=APPEND_PARAMS, body={"values": rows})
+    except gspread.exceptions.APIError as e:
+        if not sheet_missing(e):
+            raise  # lot gardé en file, renvoyé au prochain passage
+        ws(name)  # crée la feuille manquante
+        with _sheets_slots:
+            _ss.values_append(rng, params=APPEND_PARAMS, body={"values": rows})
+
+
+def flush_writes():
+    for name in list(_pending):
+        try:
+            flush_sheet(name)
+        except Exception:
+            pass  # lot conservé, nouvel essai au prochain passage
+
+
+async def periodic_flush():
+    while True:
+        await asyncio.sleep(FLUSH_EVERY_S)
+        if any(_pending.values()):
+            await run_in_threadpool(flush_writes)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    task = asyncio.create_task(periodic_flush())
+    try:
+        yield
+    finally:
+        task.cancel()
+        await run_in_threadpool(flush_writes)  # rien ne se perd à l'arrêt
+
+
+def cache_append(name: str, rows: List[list]):
+    # mêmes valeurs que get_all_values() les rendrait : du texte
+    with _sheet_lock:
+        _sheet_gen[name] = _sheet_gen.get(name, 0) + 1
+        hit = _sheet_cache.get(name)
+        if hit:
+            rows = [[str(v) for v in r] for r in rows]
+            idx = dict(hit[2])  # copie : les lecteurs en cours gardent l'ancien index intact
+            for r in rows:
+                idx[r[0]] = idx.get(r[0], []) + [r]
+            _sheet_cache[name] = (hit[0], hit[1] + rows, idx, hit[3])
+    notify_change()
+
+
+def invalidate(name: str):
+    with _sheet_lock:
+        _sheet_gen[name] = _sheet_gen.get(name, 0) + 1
+        _sheet_cache.pop(name, None)
+    notify_change()
+
+
 def today_iso() -> str:
-    now = datetime.now()
-    return date(now.year, now.month, now.day).isoformat()
+    return date.today().isoformat()
 
 
+@lru_cache(maxsize=512)
 def pretty_fr_header(iso: str) -> str:
     y, m, d = map(int, iso.split("-"))
     dt = date(y, m, d)
@@ -81,6 +383,12 @@ def pretty_fr_header(iso: str) -> str:
 
 
 def to_iso_any(s: str) -> str:
+    # seule l'analyse est mémorisée : le repli sur aujourd'hui doit suivre la date du jour
+    return parse_any_date(s) or today_iso()
+
+
+@lru_cache(maxsize=512)
+def parse_any_date(s: str) -> Optional[str]:
     s = (s or "").strip()
     if len(s) == 10 and s[2] == "." and s[5] == ".":
         dd, mm, yyyy = s.split(".")
@@ -90,15 +398,31 @@ def to_iso_any(s: str) -> str:
     try:
         return datetime.fromisoformat(s).date().isoformat()
     except Exception:
-        return today_iso()
+        return None
+
+
+@lru_cache(maxsize=512)
+def parse_iso(iso: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(iso)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=512)
+def iso_to_ddmmyyyy(iso: str) -> Optional[str]:
+    try:
+        y, m, d = map(int, iso.split("-"))
+    except ValueError:
+        return None
+    return f"{d:02d}.{m:02d}.{y:04d}"
 
 
 def norm_name(s: str) -> str:
     return " ".join((s or "").strip().upper().split())
 
 # ---------------- FastAPI & Templates ----------------
-app = FastAPI(title=APP_TITLE)
-TEMPLATES = Jinja2Templates(directory="templates")
+app = FastAPI(title=APP_TITLE, default_response_class=ORJSONResponse, lifespan=lifespan)  # orjson : sérialisation JSON en C
 
 PAGE_HTML = """<!DOCTYPE html><html><head><meta charset='utf-8'><title>CAFÉTÉRIA CO FLORENCE</title>
 <style>body{margin:0;padding:0;font-family:sans-serif;text-align:center}h1{color:red}</style></head>
@@ -106,13 +430,13 @@ PAGE_HTML = """<!DOCTYPE html><html><head><meta charset='utf-8'><title>CAFÉTÉR
   <h1>CAFÉTÉRIA CO FLORENCE</h1>
   <div id="jours"></div><div id="list" style="display:none;"></div>
 <script>
-let availableDays=[], reservationsMap={};
-async function loadInitialData(){ const r = await fetch('/api/initial'); const data = await r.json(); availableDays=data.days; reservationsMap=data.reservations; renderHome(); }
-function renderHome(){ const joursDiv=document.getElementById('jours'), listDiv=document.getElementById('list'); listDiv.style.display='none'; joursDiv.style.display='block'; joursDiv.innerHTML=''; availableDays.forEach(d=>{ const div=document.createElement('div'); div.style.cssText='display:inline-block;border:1px solid #ccc;padding:10px;margin:10px;border-radius:8px;min-width:200px;cursor:'+(d.open&&!d.disabled?'pointer':'default')+';opacity:'+(d.open?1:.4);'+(d.disabled?'color:red;border-color:red;':''); div.innerHTML='<strong>'+d.jour+'</strong><div>'+d.date+'</div><div style="white-space:pre-line">'+(d.menu||'')+'</div>'; if(d.open&&!d.disabled){ div.onclick=()=>showList(d.date);} joursDiv.appendChild(div); }); }
-function showList(date){ const joursDiv=document.getElementById('jours'), listDiv=document.getElementById('list'); joursDiv.style.display='none'; listDiv.style.display='block'; listDiv.innerHTML=''; const dayObj=availableDays.find(d=>d.date===date); const h2=document.createElement('h2'); h2.textContent='Inscriptions pour '+(dayObj?dayObj.jour+' ':'')+date; listDiv.appendChild(h2); if(dayObj){ const m=document.createElement('div'); m.textContent=dayObj.menu||''; listDiv.appendChild(m); } const list=(reservationsMap[date]||[]); const actions=document.createElement('div'); const back=document.createElement('button'); back.textContent='← Retour'; back.onclick=renderHome; actions.appendChild(back); if(list.length<40){ const ins=document.createElement('button'); ins.textContent="S'inscrire"; ins.onclick=()=>openRegisterModal(date); actions.appendChild(ins); } listDiv.appendChild(actions); const grid=document.createElement('div'); grid.style.cssText='display:flex;gap:8px;justify-content:center;margin:10px auto;max-width:800px;'; for(let c=0;c<4;c++){ const col=document.createElement('div'); col.style.cssText='flex:1;display:flex;flex-direction:column;gap:4px;'; const slice=list.slice(c*10,c*10+10); if(!slice.length){ const e=document.createElement('div'); e.style.visibility='hidden'; e.textContent='—'; col.appendChild(e);} slice.forEach(n=>{ const p=document.createElement('div'); p.style.cssText='border:1px solid #ccc;border-radius:8px;padding:6px 10px;'; p.textContent=n; p.onclick=()=>openUnregisterModal(n,date); col.appendChild(p); }); grid.appendChild(col);} listDiv.appendChild(grid); }
+let availableDays=[], reservationsMap={}, currentDate=null;
+function loadInitialData(){ const es=new EventSource('/api/stream/initial'); es.onmessage=e=>{ const data=JSON.parse(e.data); availableDays=data.days; reservationsMap=data.reservations; if(currentDate) showList(currentDate); else renderHome(); }; }
+function renderHome(){ currentDate=null; const joursDiv=document.getElementById('jours'), listDiv=document.getElementById('list'); listDiv.style.display='none'; joursDiv.style.display='block'; joursDiv.innerHTML=''; availableDays.forEach(d=>{ const div=document.createElement('div'); div.style.cssText='display:inline-block;border:1px solid #ccc;padding:10px;margin:10px;border-radius:8px;min-width:200px;cursor:'+(d.open&&!d.disabled?'pointer':'default')+';opacity:'+(d.open?1:.4);'+(d.disabled?'color:red;border-color:red;':''); div.innerHTML='<strong>'+d.jour+'</strong><div>'+d.date+'</div><div style="white-space:pre-line">'+(d.menu||'')+'</div>'; if(d.open&&!d.disabled){ div.onclick=()=>showList(d.date);} joursDiv.appendChild(div); }); }
+function showList(date){ currentDate=date; const joursDiv=document.getElementById('jours'), listDiv=document.getElementById('list'); joursDiv.style.display='none'; listDiv.style.display='block'; listDiv.innerHTML=''; const dayObj=availableDays.find(d=>d.date===date); const h2=document.createElement('h2'); h2.textContent='Inscriptions pour '+(dayObj?dayObj.jour+' ':'')+date; listDiv.appendChild(h2); if(dayObj){ const m=document.createElement('div'); m.textContent=dayObj.menu||''; listDiv.appendChild(m); } const list=(reservationsMap[date]||[]); const actions=document.createElement('div'); const back=document.createElement('button'); back.textContent='← Retour'; back.onclick=renderHome; actions.appendChild(back); if(list.length<40){ const ins=document.createElement('button'); ins.textContent="S'inscrire"; ins.onclick=()=>openRegisterModal(date); actions.appendChild(ins); } listDiv.appendChild(actions); const grid=document.createElement('div'); grid.style.cssText='display:flex;gap:8px;justify-content:center;margin:10px auto;max-width:800px;'; for(let c=0;c<4;c++){ const col=document.createElement('div'); col.style.cssText='flex:1;display:flex;flex-direction:column;gap:4px;'; const slice=list.slice(c*10,c*10+10); if(!slice.length){ const e=document.createElement('div'); e.style.visibility='hidden'; e.textContent='—'; col.appendChild(e);} slice.forEach(n=>{ const p=document.createElement('div'); p.style.cssText='border:1px solid #ccc;border-radius:8px;padding:6px 10px;'; p.textContent=n; p.onclick=()=>openUnregisterModal(n,date); col.appendChild(p); }); grid.appendChild(col);} listDiv.appendChild(grid); }
 function modal(html, bind){ const d=document.createElement('div'); d.style.cssText='position:fixed;inset:0;background:rgba(0,0,0,.5);display:flex;align-items:center;justify-content:center;'; const b=document.createElement('div'); b.style.cssText='background:#fff;padding:20px;border-radius:10px;min-width:300px;'; b.innerHTML=html; d.appendChild(b); document.body.appendChild(d); bind({close:()=>d.remove()}); }
-function openRegisterModal(date){ modal('<h3>Votre nom</h3><input id="n" style="width:100%"><div style="text-align:right;margin-top:10px"><button id="ok">Valider</button></div>', ({close})=>{ document.getElementById('ok').onclick=async ()=>{ const name=document.getElementById('n').value.trim(); if(!name)return; const r=await fetch('/api/reserve',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name, dateStr:date})}); alert(await r.text()); close(); loadInitialData(); }; }); }
-function openUnregisterModal(name,date){ modal('<h3>Désinscrire '+name+' ?</h3><div style="text-align:right;margin-top:10px"><button id="ok">Confirmer</button></div>', ({close})=>{ document.getElementById('ok').onclick=async ()=>{ const r=await fetch('/api/unreserve',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name, dateStr:date})}); alert(await r.text()); close(); loadInitialData(); }; }); }
+function openRegisterModal(date){ modal('<h3>Votre nom</h3><input id="n" style="width:100%"><div style="text-align:right;margin-top:10px"><button id="ok">Valider</button></div>', ({close})=>{ document.getElementById('ok').onclick=async ()=>{ const name=document.getElementById('n').value.trim(); if(!name)return; const r=await fetch('/api/reserve',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name, dateStr:date})}); alert(await r.text()); close(); }; }); }
+function openUnregisterModal(name,date){ modal('<h3>Désinscrire '+name+' ?</h3><div style="text-align:right;margin-top:10px"><button id="ok">Confirmer</button></div>', ({close})=>{ document.getElementById('ok').onclick=async ()=>{ const r=await fetch('/api/unreserve',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name, dateStr:date})}); alert(await r.text()); close(); }; }); }
 window.addEventListener('load', loadInitialData);
 </script></body></html>"""
 
@@ -136,12 +460,12 @@ CAISSE_HTML = """<!DOCTYPE html><html><head><meta charset='utf-8'><title>Caisse
 let dateIso=null; function chf(n){return (Math.round(n*100)/100).toFixed(2)+' CHF'}
 function toast(m){const t=document.getElementById('toast');t.textContent=m;t.style.display='block';setTimeout(()=>t.style.display='none',1200)}
 function fmtHeader(iso){if(!iso)return'';const p=iso.split('-').map(Number);const d=new Date(p[0],p[1]-1,p[2]);const days=['Dimanche','Lundi','Mardi','Mercredi','Jeudi','Vendredi','Samedi'];return 'Caisse - '+days[d.getDay()]+' '+String(p[2]).padStart(2,'0')+'.'+String(p[1]).padStart(2,'0')}
-async function refresh(){ const r=await fetch('/api/caisse?date='+(dateIso||'')); const data=await r.json(); update(data); }
+function subscribe(){ const es=new EventSource('/api/stream?date='+(dateIso||'')); es.onmessage=e=>update(JSON.parse(e.data)); }
 function update(data){ dateIso=data.date||dateIso; document.getElementById('title').textContent=fmtHeader(dateIso); const T=data.totals||{menus:0,eleves:0,profs:0,sandwiches:0,beverages:0,chocolates:0,amount:0}; const t=document.getElementById('totals'); t.innerHTML=''; ['Menus: '+T.menus+' (élèves '+T.eleves+', profs '+T.profs+')','Sandwiches: '+T.sandwiches,'Boissons: '+T.beverages,'Chocolats: '+T.chocolates,'Total cash: '+chf(T.amount)].forEach((x,i)=>{ const s=document.createElement('span'); s.style.cssText='border:1px solid #ddd;border-radius:999px;padding:4px 8px;background:#fff;'+(i==4?'font-weight:700;':''); s.textContent=x; t.appendChild(s); }); const list=(data.names||[]).slice(0,40); const box=document.getElementById('names'); box.innerHTML=''; for(let c=0;c<4;c++){ const col=document.createElement('div'); for(let i=0;i<10;i++){ const name=list[c*10+i]; const row=document.createElement('div'); row.style.cssText='display:flex;align-items:center;justify-content:space-between;padding:6px 8px;border:1px solid #ddd;border-radius:8px;background:#fff;'; if(name){ const left=document.createElement('div'); left.textContent=name; const btn=document.createElement('button'); btn.textContent='Valider'; btn.onclick=(()=>nm=>()=>openModal(nm))(name)(); row.appendChild(left); row.appendChild(btn); } else { row.style.visibility='hidden'; row.textContent='—'; } col.appendChild(row);} box.appendChild(col);} }
 function openModal(name){ const ov=document.createElement('div'); ov.style.cssText='position:fixed;inset:0;background:rgba(0,0,0,.45);display:flex;align-items:center;justify-content:center'; const b=document.createElement('div'); b.style.cssText='background:#fff;border-radius:10px;padding:16px;min-width:320px'; b.innerHTML=`<h3>${name||'Menu spontané'}</h3><div style='margin:6px 0'><label><input type='radio' name='u' value='ELEVE' checked> Élève (8)</label> <label><input type='radio' name='u' value='PROF'> Prof (12)</label></div><div style='margin:6px 0'><label><input type='radio' name='p' value='CASH' checked> Cash</label> <label><input type='radio' name='p' value='CARD'> Carte abo</label></div><div style='margin:6px 0'><label><input id='bev' type='checkbox'> Boisson +2</label> <label><input id='choc' type='checkbox'> Chocolat +1.5</label></div><div id='nameRow' style='display:${name?'none':'block'}'><input id='nameInput' placeholder='Nom (facultatif)' style='width:100%'></div><div style='text-align:right;margin-top:8px'><button id='cancel'>Annuler</button> <button id='ok'>Valider</button></div>`; ov.appendChild(b); document.body.appendChild(ov); document.getElementById('cancel').onclick=()=>ov.remove(); document.getElementById('ok').onclick=async ()=>{ const t=document.querySelector("input[name='u']:checked").value; const pay=document.querySelector("input[name='p']:checked").value; const bev=document.getElementById('bev').checked; const choc=document.getElementById('choc').checked; const nm=name||document.getElementById('nameInput').value.trim()||'Anonyme'; const r=await fetch('/api/checkout',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name:nm,type:t,beverage:bev,chocolate:choc,dateIso,method:pay})}); if(!r.ok){ alert(await r.text()); ov.remove(); return; } const data=await r.json(); toast('Validé ✔'); update(data); ov.remove(); } }
 async function qty(kind){ const n=prompt('Quantité ?','1'); if(!n)return; const r=await fetch('/api/add/'+kind,{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({qty:parseInt(n||'1'),dateIso})}); update(await r.json()); toast('Ajouté'); }
 async function closeDay(){ const ok=confirm('Fermer la caisse et envoyer la comptabilité ?'); if(!ok)return; const r=await fetch('/api/close',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({dateIso})}); if((await r.json()).ok){ location.replace('/closed'); } }
-window.addEventListener('load',async()=>{ const p=new URLSearchParams(location.search); dateIso=p.get('date')||''; await refresh(); document.getElementById('walkin').onclick=()=>openModal(null); document.getElementById('sand').onclick=()=>qty('sandwich'); document.getElementById('bev').onclick=()=>qty('beverage'); document.getElementById('choc').onclick=()=>qty('chocolate'); document.getElementById('close').onclick=closeDay; });
+window.addEventListener('load',async()=>{ const p=new URLSearchParams(location.search); dateIso=p.get('date')||''; subscribe(); document.getElementById('walkin').onclick=()=>openModal(null); document.getElementById('sand').onclick=()=>qty('sandwich'); document.getElementById('bev').onclick=()=>qty('beverage'); document.getElementById('choc').onclick=()=>qty('chocolate'); document.getElementById('close').onclick=closeDay; });
 </script>
 </body></html>"""
 
@@ -149,35 +473,55 @@ CLOSED_HTML = """<!DOCTYPE html><html><head><meta charset='utf-8'><title>Caisse
 <style>body{margin:0;padding:0;font-family:sans-serif;display:flex;align-items:center;justify-content:center;min-height:100vh}</style></head>
 <body><div style='text-align:center'><h2>La caisse est désormais fermée</h2><p>La comptabilité a été transmise.</p></div></body></html>"""
 
-# On écrit les templates à la volée (compatible PyInstaller --add-data)
-os.makedirs('templates', exist_ok=True)
-open('templates/page.html','w',encoding='utf-8').write(PAGE_HTML)
-open('templates/caisse.html','w',encoding='utf-8').write(CAISSE_HTML)
-open('templates/closed.html','w',encoding='utf-8').write(CLOSED_HTML)
-
 # ---------------- Pages ----------------
+# Pages statiques (aucune variable) : servies telles quelles, sans Jinja ni fichiers sur disque.
+# Encodées et compressées une fois à l'import : (corps, corps gzip, etag) ; la variante gzip a son propre etag.
+def precompressed(html: str):
+    body = html.encode("utf-8")
+    return body, gzip.compress(body, 9), hashlib.sha1(body).hexdigest()[:16]
+
+PAGE_BODY = precompressed(PAGE_HTML)
+CAISSE_BODY = precompressed(CAISSE_HTML)
+CLOSED_BODY = precompressed(CLOSED_HTML)
+
+def html_body(req: Request, pre) -> Response:
+    body, gz, digest = pre
+    use_gzip = "gzip" in req.headers.get("accept-encoding", "")
+    etag = f'"{digest}-gz"' if use_gzip else f'"{digest}"'
+    headers = {"Cache-Control": "public, max-age=60", "ETag": etag, "Vary": "Accept-Encoding"}
+    if req.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = gz
+    return Response(body, media_type="text/html", headers=headers)
+
 @app.get("/", response_class=HTMLResponse)
-def home(req: Request):
-    return TEMPLATES.TemplateResponse("page.html", {"request": req})
+async def home(req: Request):
+    return html_body(req, PAGE_BODY)
 
 @app.get("/caisse", response_class=HTMLResponse)
-def caisse(req: Request):
-    return TEMPLATES.TemplateResponse("caisse.html", {"request": req})
+async def caisse(req: Request):
+    return html_body(req, CAISSE_BODY)
 
 @app.get("/closed", response_class=HTMLResponse)
-def closed(req: Request):
-    return TEMPLATES.TemplateResponse("closed.html", {"request": req})
+async def closed(req: Request):
+    return html_body(req, CLOSED_BODY)
 
 # ---------------- API (Sheets) ----------------
-class ReserveIn(BaseModel):
+class ApiIn(BaseModel):
+    # corps de requête : espaces retirés dès la validation, champs inconnus ignorés, lecture seule
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True, frozen=True)
+
+class ReserveIn(ApiIn):
     name: str
     dateStr: str  # dd.MM.yyyy
 
-class UnreserveIn(BaseModel):
+class UnreserveIn(ApiIn):
     name: str
     dateStr: str
 
-class CheckoutIn(BaseModel):
+class CheckoutIn(ApiIn):
     name: str
     type: str  # ELEVE | PROF
     beverage: bool = False
@@ -185,37 +529,56 @@ class CheckoutIn(BaseModel):
     dateIso: Optional[str] = None
     method: str = "CASH"  # CASH | CARD
 
-class QtyIn(BaseModel):
+class QtyIn(ApiIn):
     qty: int
     dateIso: Optional[str] = None
 
-class CloseIn(BaseModel):
+class CloseIn(ApiIn):
     dateIso: Optional[str] = None
 
 @app.get("/api/initial")
-def api_initial():
-    today = date.today()
-    # Lire Paramètres
-    psh = ws("Paramètres")
-    pvals = psh.get_all_values()
-    rows = []
+async def api_initial(req: Request):
+    # le contenu dépend aussi du jour (dates passées écartées)
+    return await run_in_threadpool(conditional_json, req, ["Paramètres", "Réservations"], today_iso(), initial_payload)
+
+# Dates ouvertes de Paramètres par jour de semaine, triées : (dates iso, entrées). Recalculé seulement quand
+# la liste en cache change (relecture ou écriture), les appels suivants ne font qu'une recherche dichotomique.
+_open_by_day: Tuple[Optional[list], Dict[str, Tuple[List[str], List[dict]]]] = (None, {})
+
+def open_dates_by_day(pvals: List[List[str]]) -> Dict[str, Tuple[List[str], List[dict]]]:
+    global _open_by_day
+    src, table = _open_by_day
+    if src is pvals:
+        return table
+    by_day: Dict[str, List[Tuple[str, dict]]] = defaultdict(list)
     for r in pvals[1:]:  # skip header
         if not r or len(r) < 5: continue
         iso, jour, menu, open_str, dis_str = r[:5]
-        try:
-            d = date.fromisoformat(iso)
-        except Exception:
+        d = parse_iso(iso)
+        if d is None or open_str.lower() not in TRUTHY:
             continue
-        rows.append({"date_iso": iso, "jour": jour, "menu": menu, "open": open_str.lower() in ("1","true","vrai","yes"), "disabled": dis_str.lower() in ("1","true","vrai","yes")})
+        by_day[jour].append((d.isoformat(), {"date_iso": iso, "menu": menu, "disabled": dis_str.lower() in TRUTHY}))
+    table = {}
+    for jour, entries in by_day.items():
+        entries.sort(key=lambda e: e[0])  # clé normalisée : l'ordre du texte est celui des dates
+        table[jour] = ([k for k, _ in entries], [e for _, e in entries])
+    _open_by_day = (pvals, table)  # remplacement d'un bloc : sûr entre threads
+    return table
+
+def initial_payload():
+    today = date.today()
+    today_s = today.isoformat()
+    # Lire Paramètres
+    sheets = get_many(["Paramètres", "Réservations"])
+    by_day = open_dates_by_day(sheets["Paramètres"])
     wanted = ["Lundi","Mardi","Jeudi","Vendredi"]
 
     def first_open(day_name: str):
-        cand = [e for e in rows if e["jour"] == day_name and e["open"] and date.fromisoformat(e["date_iso"]) >= today]
-        cand.sort(key=lambda x: x["date_iso"])  # ASC
-        if cand:
-            e = cand[0]
-            y, m, d = map(int, e["date_iso"].split("-"))
-            return {"date": f"{d:02d}.{m:02d}.{y:04d}", "jour": day_name, "menu": e["menu"], "open": True, "disabled": e["disabled"]}
+        dates, entries = by_day.get(day_name, ((), ()))
+        i = bisect_left(dates, today_s)  # première date ouverte >= aujourd'hui
+        if i < len(dates):
+            e = entries[i]
+            return {"date": iso_to_ddmmyyyy(e["date_iso"]), "jour": day_name, "menu": e["menu"], "open": True, "disabled": e["disabled"]}
         # sinon, prochaine date fictive pour affichage (fermée)
         # calcule prochaine occurrence du weekday
         wd = {"Lundi":0, "Mardi":1, "Mercredi":2, "Jeudi":3, "Vendredi":4, "Samedi":5, "Dimanche":6}[day_name]
@@ -226,51 +589,55 @@ def api_initial():
     days_out = [first_open(w) for w in wanted]
 
     # Réservations map par dd.MM.yyyy
-    rsh = ws("Réservations")
-    rvals = rsh.get_all_values()[1:]
+    rvals = sheets["Réservations"][1:]
     reservations: Dict[str, List[str]] = {}
     for row in rvals:
         if len(row) < 2: continue
         iso, name = row[0], (row[1] or "").strip()
         if not iso or not name: continue
-        try:
-            y, m, d = map(int, iso.split("-"))
-        except Exception:
-            continue
-        key = f"{d:02d}.{m:02d}.{y:04d}"
+        key = iso_to_ddmmyyyy(iso)
+        if key is None: continue
         reservations.setdefault(key, []).append(name)
 
     return {"days": days_out, "reservations": reservations}
 
 @app.post("/api/reserve", response_class=PlainTextResponse)
-def api_reserve(inp: ReserveIn):
+async def api_reserve(inp: ReserveIn):
+    return await run_in_threadpool(reserve, inp)
+
+def reserve(inp: ReserveIn):
     iso = to_iso_any(inp.dateStr)
-    psh = ws("Paramètres")
     # vérifier ouvert
-    pvals = psh.get_all_values()[1:]
-    is_open = any((r and len(r)>=4 and r[0]==iso and r[3].lower() in ("1","true","vrai","yes")) for r in pvals)
+    is_open = any((len(r)>=4 and r[3].lower() in TRUTHY) for r in day_rows("Paramètres", iso))
     if not is_open:
         raise HTTPException(400, f"Le {inp.dateStr} est fermé, impossible de réserver.")
-    # quota 40
-    rsh = ws("Réservations")
-    rvals = rsh.get_all_values()[1:]
-    count = sum(1 for r in rvals if r and r[0]==iso)
-    if count >= MAX_RESAS:
-        raise HTTPException(400, f"Quota de 40 atteint pour le {inp.dateStr}.")
-    rsh.append_row([iso, inp.name.strip(), datetime.utcnow().isoformat()])
+    # quota 40 : relu sans cache, et lecture + mise en file sous le verrou de la feuille (réentrant) pour que
+    # deux tablettes ne puissent pas dépasser 40 ensemble
+    with sheet_io("Réservations"):
+        count = len(day_rows("Réservations", iso, ttl=0))
+        if count >= MAX_RESAS:
+            raise HTTPException(400, f"Quota de 40 atteint pour le {inp.dateStr}.")
+        queue_rows("Réservations", [[iso, inp.name, datetime.utcnow().isoformat()]])
     return f"Merci {inp.name}, réservation confirmée pour le {inp.dateStr} !"
 
 @app.post("/api/unreserve", response_class=PlainTextResponse)
-def api_unreserve(inp: UnreserveIn):
+async def api_unreserve(inp: UnreserveIn):
+    return await run_in_threadpool(unreserve, inp)
+
+def unreserve(inp: UnreserveIn):
     iso = to_iso_any(inp.dateStr)
-    name = (inp.name or "").strip()
-    rsh = ws("Réservations")
-    vals = rsh.get_all_values()
-    # chercher la première occurrence et supprimer la ligne
-    for i, row in enumerate(vals[1:], start=2):
-        if len(row)>=2 and row[0]==iso and (row[1] or '').strip()==name:
-            rsh.delete_rows(i)
-            return f"Vous êtes désinscrit pour le {inp.dateStr}."
+    name = inp.name
+    # numéros de ligne : file vidée puis feuille relue sans cache, sous le verrou de la feuille,
+    # pour ne pas supprimer la mauvaise ligne
+    with sheet_io("Réservations"):
+        flush_sheet("Réservations")
+        vals = get_values("Réservations", ttl=0)
+        # chercher la première occurrence et supprimer la ligne
+        for i, row in enumerate(vals[1:], start=2):
+            if len(row)>=2 and row[0]==iso and (row[1] or '').strip()==name:
+                delete_row("Réservations", i)
+                invalidate("Réservations")
+                return f"Vous êtes désinscrit pour le {inp.dateStr}."
     raise HTTPException(400, f"Pas de réservation trouvée pour \"{name}\" le {inp.dateStr}.")
 
 class Totals(BaseModel):
@@ -290,21 +657,21 @@ class CaisseOut(BaseModel):
 
 
 def is_closed(iso: str) -> bool:
-    csh = ws("Caisse")
-    vals = csh.get_all_values()[1:]
-    for r in vals:
-        if len(r)>=3 and r[0]==iso and (r[2] or '')=='Closed':
-            return True
-    return False
+    return scan_caisse(day_rows("Caisse", iso))[0]
 
 
 def build_totals(iso: str):
-    csh = ws("Caisse")
-    vals = csh.get_all_values()[1:]
+    _, t, paidCount = scan_caisse(day_rows("Caisse", iso))
+    return t, paidCount
+
+
+def scan_caisse(rows: List[List[str]]):
+    # un seul passage sur les lignes du jour : fermeture, totaux et payés par nom
+    closed = False
     t = Totals()
     paidCount: Dict[str,int] = {}
-    for r in vals:
-        if len(r) < 7 or r[0] != iso: 
+    for r in rows:
+        if len(r) < 7:
             continue
         typ = r[2]
         base = float(r[3] or 0)
@@ -312,6 +679,7 @@ def build_totals(iso: str):
         choc = float(r[5] or 0)
         tot  = float(r[6] or 0)
         if typ == 'Closed':
+            closed = True
             continue
         elif typ == 'Sandwich':
             t.sandwiches += 1
@@ -328,19 +696,21 @@ def build_totals(iso: str):
             if bev > 0: t.beverages += 1
             if choc > 0: t.chocolates += 1
         t.amount += tot
-    return t, paidCount
+    return closed, t, paidCount
 
 @app.get("/api/caisse")
-def api_caisse(date: Optional[str] = None):
+async def api_caisse(req: Request, date: Optional[str] = None):
     iso = date if (date and len(date)==10) else today_iso()
-    if is_closed(iso):
-        t,_ = build_totals(iso)
+    return await run_in_threadpool(conditional_json, req, ["Caisse", "Réservations"], iso,
+                                   lambda: caisse_snapshot(iso).model_dump())
+
+def caisse_snapshot(iso: str):
+    sheets = load_sheets(["Caisse", "Réservations"])  # un seul aller-retour si le cache est froid
+    closed, t, paidCount = scan_caisse(sheets["Caisse"][1].get(iso, []))
+    if closed:
         return CaisseOut(date=iso, closed=True, names=[], totals=t)
     # ordre d'inscription : selon l'ordre dans la feuille (append)
-    rsh = ws("Réservations")
-    rows = rsh.get_all_values()[1:]
-    ordered = [(r[1] or '').strip() for r in rows if len(r)>=2 and r[0]==iso and (r[1] or '').strip()]
-    t, paidCount = build_totals(iso)
+    ordered = [(r[1] or '').strip() for r in sheets["Réservations"][1].get(iso, []) if len(r)>=2 and (r[1] or '').strip()]
     # retirer ceux déjà validés
     remaining: List[str] = []
     paid_left = dict(paidCount)
@@ -353,20 +723,56 @@ def api_caisse(date: Optional[str] = None):
     return CaisseOut(date=iso, closed=False, names=remaining, totals=t)
 
 
+# Flux SSE : un instantané à l'abonnement, puis un nouveau seulement quand l'ETag change (écriture de
+# l'appli, ou modification manuelle vue au rafraîchissement du cache toutes les SHEET_TTL secondes).
+async def event_stream(req: Request, names: List[str], key, build):
+    last = None
+    while not await req.is_disconnected():
+        changed = _changed  # pris avant le calcul : une écriture pendant celui-ci n'est pas perdue
+        etag = await run_in_threadpool(fresh_etag, names, key())
+        if etag != last:
+            last = etag
+            yield b"data: " + orjson.dumps(await run_in_threadpool(build)) + b"\n\n"
+        else:
+            yield b": ping\n\n"  # garde la connexion ouverte et détecte les déconnexions
+        try:
+            await asyncio.wait_for(changed.wait(), SHEET_TTL)
+        except asyncio.TimeoutError:
+            pass
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.get("/api/stream")
+async def api_stream(req: Request, date: Optional[str] = None):
+    iso = date if (date and len(date)==10) else today_iso()
+    gen = event_stream(req, ["Caisse", "Réservations"], lambda: iso, lambda: caisse_snapshot(iso).model_dump())
+    return StreamingResponse(gen, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/api/stream/initial")
+async def api_stream_initial(req: Request):
+    gen = event_stream(req, ["Paramètres", "Réservations"], today_iso, initial_payload)
+    return StreamingResponse(gen, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 def assert_open(iso: str):
     if is_closed(iso):
         raise HTTPException(400, f"Caisse fermée pour {iso}.")
 
-def assert_capacity(iso: str):
-    t,_ = build_totals(iso)
+def assert_open_with_capacity(iso: str):
+    # fermeture et limite de menus vérifiées sur un seul passage
+    closed, t, _ = scan_caisse(day_rows("Caisse", iso))
+    if closed:
+        raise HTTPException(400, f"Caisse fermée pour {iso}.")
     if t.menus >= MAX_MENUS:
         raise HTTPException(400, f"Limite de 45 menus servis atteinte pour {pretty_fr_header(iso)}.")
 
 @app.post("/api/checkout")
-def api_checkout(inp: CheckoutIn):
+async def api_checkout(inp: CheckoutIn):
+    return await run_in_threadpool(checkout, inp)
+
+def checkout(inp: CheckoutIn):
     iso = inp.dateIso or today_iso()
-    assert_open(iso)
-    assert_capacity(iso)
+    assert_open_with_capacity(iso)
     typ = (inp.type or 'PROF').upper()
     method = (inp.method or 'CASH').upper()
     base = PRICES['ELEVE'] if typ=='ELEVE' else PRICES['PROF']
@@ -374,39 +780,41 @@ def api_checkout(inp: CheckoutIn):
     choc = PRICES['CHOCOLAT'] if inp.chocolate else 0.0
     total_cash = (bev+choc) if method=='CARD' else (base+bev+choc)
     label = ('Eleve' if typ=='ELEVE' else 'Prof') + (' (CARD)' if method=='CARD' else ' (CASH)')
-    csh = ws('Caisse')
-    csh.append_row([iso, inp.name.strip() or 'Anonyme', label, base, bev, choc, total_cash, datetime.utcnow().isoformat()])
-    return api_caisse(iso)
-
-@app.post("/api/add/sandwich")
-def api_add_sandwich(inp: QtyIn):
+    row = [iso, inp.name or 'Anonyme', label, base, bev, choc, total_cash, datetime.utcnow().isoformat()]
+    queue_rows('Caisse', [row])
+    return caisse_snapshot(iso)
+
+# Ligne Caisse par article, sans la date ni l'horodatage : (type, base, boisson, chocolat, total)
+ADD_ROWS = {
+    "sandwich": ('Sandwich', PRICES['SANDWICH'], 0, 0, PRICES['SANDWICH']),
+    "beverage": ('Boisson', 0, PRICES['BOISSON'], 0, PRICES['BOISSON']),
+    "chocolate": ('Chocolat', 0, 0, PRICES['CHOCOLAT'], PRICES['CHOCOLAT']),
+}
+
+def add_items(kind: str, inp: QtyIn):
     iso = inp.dateIso or today_iso(); assert_open(iso)
     n = max(1, int(inp.qty or 1))
-    csh = ws('Caisse')
-    rows = [[iso, '', 'Sandwich', PRICES['SANDWICH'], 0, 0, PRICES['SANDWICH'], datetime.utcnow().isoformat()] for _ in range(n)]
-    csh.append_rows(rows)
-    return api_caisse(iso)
+    row = [iso, '', *ADD_ROWS[kind], datetime.utcnow().isoformat()]  # même horodatage pour tout le lot
+    queue_rows('Caisse', [list(row) for _ in range(n)])
+    return caisse_snapshot(iso)
+
+@app.post("/api/add/sandwich")
+async def api_add_sandwich(inp: QtyIn):
+    return await run_in_threadpool(add_items, "sandwich", inp)
 
 @app.post("/api/add/beverage")
-def api_add_beverage(inp: QtyIn):
-    iso = inp.dateIso or today_iso(); assert_open(iso)
-    n = max(1, int(inp.qty or 1))
-    csh = ws('Caisse')
-    rows = [[iso, '', 'Boisson', 0, PRICES['BOISSON'], 0, PRICES['BOISSON'], datetime.utcnow().isoformat()] for _ in range(n)]
-    csh.append_rows(rows)
-    return api_caisse(iso)
+async def api_add_beverage(inp: QtyIn):
+    return await run_in_threadpool(add_items, "beverage", inp)
 
 @app.post("/api/add/chocolate")
-def api_add_chocolate(inp: QtyIn):
-    iso = inp.dateIso or today_iso(); assert_open(iso)
-    n = max(1, int(inp.qty or 1))
-    csh = ws('Caisse')
-    rows = [[iso, '', 'Chocolat', 0, 0, PRICES['CHOCOLAT'], PRICES['CHOCOLAT'], datetime.utcnow().isoformat()] for _ in range(n)]
-    csh.append_rows(rows)
-    return api_caisse(iso)
+async def api_add_chocolate(inp: QtyIn):
+    return await run_in_threadpool(add_items, "chocolate", inp)
 
 @app.post("/api/close")
-def api_close(inp: CloseIn):
+async def api_close(inp: CloseIn):
+    return await run_in_threadpool(close_day, inp)
+
+def close_day(inp: CloseIn):
     iso = inp.dateIso or today_iso()
     # envoyer mail (facultatif)
     try:
@@ -417,8 +825,8 @@ def api_close(inp: CloseIn):
     except Exception:
         pass
     # marquer fermeture
-    csh = ws('Caisse')
-    csh.append_row([iso, '', 'Closed', 0, 0, 0, 0, datetime.utcnow().isoformat()])
+    row = [iso, '', 'Closed', 0, 0, 0, 0, datetime.utcnow().isoformat()]
+    queue_rows('Caisse', [row])
     return {"ok": True}
 
 # ---------------- E-mail (optionnel) ----------------